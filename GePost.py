@@ -1,70 +1,282 @@
 import random
 import asyncio
-import json
 import os
-from datetime import datetime, timedelta
+import re
+import time
+import traceback
+import aiohttp
+from aiolimiter import AsyncLimiter
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from pathlib import Path
-from pixivpy3 import AppPixivAPI
+from typing import Optional
+from pixivpy_async import AppPixivAPI
 from telegram import Bot
+from telegram.error import RetryAfter
+from telegram.request import HTTPXRequest
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential_jitter
+import atexit
 import logging
+import queue
 import sys
-from zoneinfo import ZoneInfo
+from logging.handlers import QueueHandler, QueueListener
+
+# Настройка логирования с поддержкой UTF-8: записи попадают в очередь,
+# а файл и stdout пишет фоновый поток, не блокируя event loop на диске
+_log_queue = queue.SimpleQueue()
+_log_listener = QueueListener(
+    _log_queue,
+    logging.FileHandler('pixiv_bot.log', encoding='utf-8', delay=True),
+    logging.StreamHandler(sys.stdout),
+    respect_handler_level=True,
+)
+_log_listener.start()
+atexit.register(_log_listener.stop)
 
-# Настройка логирования с поддержкой UTF-8
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s [%(levelname)s] %(message)s',
-    handlers=[
-        logging.FileHandler('pixiv_bot.log', encoding='utf-8'),
-        logging.StreamHandler(sys.stdout)
-    ]
+    handlers=[QueueHandler(_log_queue)]
 )
 logger = logging.getLogger(__name__)
 
-# Определяем московский часовой пояс
-MOSCOW_TZ = ZoneInfo("Europe/Moscow")
+# orjson заметно быстрее, но не обязателен — без него работаем на stdlib
+try:
+    import orjson
+
+    def json_loads(data):
+        return orjson.loads(data)
+
+    def json_dumps(obj):
+        return orjson.dumps(obj)
+except ImportError:
+    import json
+
+    def json_loads(data):
+        return json.loads(data)
+
+    def json_dumps(obj):
+        return json.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+# Московский часовой пояс: фиксированный UTC+3 (DST отменён с 2011 года),
+# поэтому дешёвый timezone вместо ZoneInfo с обращениями к базе tzdata
+MOSCOW_TZ = timezone(timedelta(hours=3), 'MSK')
 
 # Файл конфигурации
 CONFIG_FILE = 'config.json'
 
+# Собственный генератор вместо модульного синглтона random:
+# без косвенности через module-level обёртки
+_rng = random.Random()
+
 # Настройки для безопасной работы с Pixiv API
-PIXIV_REQUEST_DELAY = 2.0  # Задержка между запросами к Pixiv (секунды)
 MAX_PAGES_TO_FETCH = 40    # Максимум страниц для сбора
 ILLUSTS_PER_PAGE = 30      # Иллюстраций на странице
+PIXIV_PAGE_TIMEOUT = 30    # Таймаут одной страницы закладок (секунды)
+
+# Таймауты сетевых вызовов: зависший TCP-read не должен
+# блокировать публикации на минуты
+TELEGRAM_CONNECT_TIMEOUT = 10
+TELEGRAM_READ_TIMEOUT = 60
+IMAGE_DOWNLOAD_TIMEOUT = 60
+
+# За сколько секунд до публикации начинать загрузку арта
+PREFETCH_LEAD_SECONDS = 30
+
+# Токен-бакет: до 6 запросов к Pixiv в секунду, всплески сглаживаются,
+# а параллельные загрузчики страниц координируются между собой
+PIXIV_RATE_LIMIT = AsyncLimiter(max_rate=6, time_period=1.0)
+
+# Повторы при временных сетевых сбоях: иначе один сбой молча
+# отменяет публикацию на целый интервал
+pixiv_retry = retry(
+    stop=stop_after_attempt(4),
+    wait=wait_exponential_jitter(initial=1, max=30),
+    retry=retry_if_exception_type((aiohttp.ClientError, asyncio.TimeoutError, OSError)),
+    reraise=True,
+)
+
+# Кэш списка закладок на диске (закладки меняются редко относительно интервала постинга)
+BOOKMARK_CACHE = Path(__file__).parent / 'bookmarks_cache.json'
+CACHE_TTL_SECONDS = 6 * 3600
+
+# Локальное состояние бота: хранить время последнего поста у себя
+# дешевле, чем заново выводить его из Telegram API
+STATE_FILE = Path(__file__).parent / 'state.json'
+
+# Вырезает суффикс размера превью из URL изображения (/c/600x1200_90/ и т.п.)
+PIXIV_THUMB_RE = re.compile(r'/c/\d+x\d+_\d+/')
+
+# Курсор пагинации — единственное, что меняется в next_url от страницы к странице
+MAX_BOOKMARK_ID_RE = re.compile(r'[?&]max_bookmark_id=(\d+)')
+
+# Pixiv отдаёт картинки только с этим Referer
+PIXIV_IMAGE_HEADERS = {'Referer': 'https://www.pixiv.net/'}
+
+# Переиспользуем авторизованный клиент Pixiv: access token живёт ~1 час,
+# поэтому перелогиниваемся только при приближении истечения
+PIXIV_AUTH_LIFETIME_SECONDS = 3000
+
+_pixiv_client = None
+_pixiv_auth_expiry = 0.0
+
+
+async def get_pixiv_client(refresh_token):
+    """Возвращает авторизованный клиент Pixiv, обновляя токен по необходимости"""
+    global _pixiv_client, _pixiv_auth_expiry
+
+    if _pixiv_client is None or time.monotonic() >= _pixiv_auth_expiry - 60:
+        if _pixiv_client is None:
+            _pixiv_client = AppPixivAPI()
+        await _pixiv_client.login(refresh_token=refresh_token)
+        _pixiv_auth_expiry = time.monotonic() + PIXIV_AUTH_LIFETIME_SECONDS
+        logger.info("Authenticated as user: %s", _pixiv_client.user_id)
+
+    return _pixiv_client
+
+
+_http_session = None
+
+
+async def get_http_session():
+    """Возвращает общую aiohttp-сессию, создавая её при первом обращении"""
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        _http_session = aiohttp.ClientSession(
+            headers=PIXIV_IMAGE_HEADERS,
+            timeout=aiohttp.ClientTimeout(total=IMAGE_DOWNLOAD_TIMEOUT),
+        )
+    return _http_session
+
+
+def load_bookmark_cache():
+    """Читает кэш закладок, если он не устарел"""
+    try:
+        if not BOOKMARK_CACHE.exists():
+            return None
+        if time.time() - BOOKMARK_CACHE.stat().st_mtime > CACHE_TTL_SECONDS:
+            return None
+        illusts = json_loads(BOOKMARK_CACHE.read_bytes())
+        return illusts or None
+    except Exception as e:
+        logger.warning("Failed to read bookmark cache: %s", e)
+        return None
+
+
+def load_last_post_time():
+    """Читает время последнего поста из файла состояния"""
+    try:
+        if not STATE_FILE.exists():
+            return None
+        state = json_loads(STATE_FILE.read_bytes())
+        last_post = state.get('last_post')
+        return datetime.fromisoformat(last_post) if last_post else None
+    except Exception as e:
+        logger.warning("Failed to read state file: %s", e)
+        return None
+
+def save_last_post_time(post_time):
+    """Атомарно сохраняет время последнего поста (tmp + os.replace)"""
+    try:
+        tmp = STATE_FILE.with_suffix('.tmp')
+        tmp.write_bytes(json_dumps({'last_post': post_time.isoformat()}))
+        os.replace(tmp, STATE_FILE)
+    except Exception as e:
+        logger.warning("Failed to write state file: %s", e)
+
+def slim_illust(illust):
+    """Оставляет от иллюстрации только поля, которые использует бот (~10x меньше)"""
+    return {
+        'id': illust['id'],
+        'title': illust['title'],
+        'author': illust['user']['name'],
+        'image_url': illust['image_urls']['medium'],
+        'total_bookmarks': illust['total_bookmarks'],
+        'total_view': illust['total_view'],
+    }
+
+def save_bookmark_cache(illusts):
+    """Сохраняет урезанный список закладок в кэш"""
+    try:
+        BOOKMARK_CACHE.write_bytes(json_dumps(illusts))
+    except Exception as e:
+        logger.warning("Failed to write bookmark cache: %s", e)
+
+@dataclass(frozen=True, slots=True)
+class BotConfig:
+    """Разобранная конфигурация бота: чтение полей — простой доступ к атрибуту
+    вместо вложенных dict.get на каждой проверке"""
+    pixiv_refresh_token: str
+    telegram_bot_token: str
+    telegram_channel_id: str
+    telegram_thread_id: Optional[str]
+    interval_seconds: int
+    deviation_minutes: int
+    post_immediately_on_start: bool
+    quiet_enabled: bool
+    quiet_start_hour: int
+    quiet_end_hour: int
+
+@lru_cache(maxsize=4)
+def get_bot(token):
+    """Возвращает общий экземпляр Bot с переиспользуемым пулом соединений"""
+    return Bot(token=token, request=HTTPXRequest(
+        connection_pool_size=8,
+        connect_timeout=TELEGRAM_CONNECT_TIMEOUT,
+        read_timeout=TELEGRAM_READ_TIMEOUT,
+    ))
+
+def parse_config(raw):
+    """Собирает BotConfig из сырого словаря (файл или переменные окружения)"""
+    quiet = raw.get('quiet_hours', {})
+
+    return BotConfig(
+        pixiv_refresh_token=raw.get('pixiv_refresh_token'),
+        telegram_bot_token=raw.get('telegram_bot_token'),
+        telegram_channel_id=raw.get('telegram_channel_id'),
+        telegram_thread_id=raw.get('telegram_thread_id'),
+        interval_seconds=int(raw.get('interval_hours', 3)) * 3600 + int(raw.get('interval_minutes', 0)) * 60,
+        deviation_minutes=int(raw.get('interval_deviation_minutes', 0)),
+        post_immediately_on_start=bool(raw.get('post_immediately_on_start', False)),
+        quiet_enabled=bool(quiet.get('enabled', False)),
+        quiet_start_hour=int(quiet.get('start_hour', 0)),
+        quiet_end_hour=int(quiet.get('end_hour', 0)),
+    )
 
 def load_config():
     """Loads configuration from file or environment variables"""
     script_dir = Path(__file__).parent
     config_path = script_dir / CONFIG_FILE
-    
+
     if config_path.exists():
-        with open(config_path, 'r', encoding='utf-8') as f:
-            config = json.load(f)
+        raw = json_loads(config_path.read_bytes())
         logger.info("Config loaded from file")
-        return config
-    
-    logger.info("Config file not found, reading from environment variables")
-    
-    config = {
-        'pixiv_refresh_token': os.getenv('PIXIV_REFRESH_TOKEN'),
-        'telegram_bot_token': os.getenv('TELEGRAM_BOT_TOKEN'),
-        'telegram_channel_id': os.getenv('TELEGRAM_CHANNEL_ID'),
-        'telegram_thread_id': os.getenv('TELEGRAM_THREAD_ID'),
-        'interval_hours': int(os.getenv('INTERVAL_HOURS', 3)),
-        'interval_minutes': int(os.getenv('INTERVAL_MINUTES', 0)),
-        'interval_deviation_minutes': int(os.getenv('INTERVAL_DEVIATION_MINUTES', 0)),
-        'post_immediately_on_start': os.getenv('POST_IMMEDIATELY_ON_START', 'false').lower() == 'true',
-        'quiet_hours': {
-            'enabled': os.getenv('QUIET_HOURS_ENABLED', 'false').lower() == 'true',
-            'start_hour': int(os.getenv('QUIET_HOURS_START', 0)),
-            'end_hour': int(os.getenv('QUIET_HOURS_END', 0))
+    else:
+        logger.info("Config file not found, reading from environment variables")
+
+        raw = {
+            'pixiv_refresh_token': os.getenv('PIXIV_REFRESH_TOKEN'),
+            'telegram_bot_token': os.getenv('TELEGRAM_BOT_TOKEN'),
+            'telegram_channel_id': os.getenv('TELEGRAM_CHANNEL_ID'),
+            'telegram_thread_id': os.getenv('TELEGRAM_THREAD_ID'),
+            'interval_hours': int(os.getenv('INTERVAL_HOURS', 3)),
+            'interval_minutes': int(os.getenv('INTERVAL_MINUTES', 0)),
+            'interval_deviation_minutes': int(os.getenv('INTERVAL_DEVIATION_MINUTES', 0)),
+            'post_immediately_on_start': os.getenv('POST_IMMEDIATELY_ON_START', 'false').lower() == 'true',
+            'quiet_hours': {
+                'enabled': os.getenv('QUIET_HOURS_ENABLED', 'false').lower() == 'true',
+                'start_hour': int(os.getenv('QUIET_HOURS_START', 0)),
+                'end_hour': int(os.getenv('QUIET_HOURS_END', 0))
+            }
         }
-    }
-    
-    if not config['pixiv_refresh_token'] or not config['telegram_bot_token'] or not config['telegram_channel_id']:
+        logger.info("Config loaded from environment")
+
+    config = parse_config(raw)
+
+    if not config.pixiv_refresh_token or not config.telegram_bot_token or not config.telegram_channel_id:
         raise ValueError("Missing required environment variables: PIXIV_REFRESH_TOKEN, TELEGRAM_BOT_TOKEN, TELEGRAM_CHANNEL_ID")
-    
-    logger.info("Config loaded from environment")
+
     return config
 
 def calculate_next_interval(base_seconds, deviation_minutes):
@@ -72,177 +284,204 @@ def calculate_next_interval(base_seconds, deviation_minutes):
     if deviation_minutes == 0:
         return base_seconds
     
-    deviation_seconds = random.randint(-deviation_minutes * 60, deviation_minutes * 60)
+    deviation_seconds = _rng.randint(-deviation_minutes * 60, deviation_minutes * 60)
     result_seconds = max(60, base_seconds + deviation_seconds)
     
     if deviation_seconds != 0:
         sign = "+" if deviation_seconds > 0 else ""
-        logger.info(f"Interval deviation: {sign}{format_time(abs(deviation_seconds))}")
+        logger.info("Interval deviation: %s%s", sign, format_time(abs(deviation_seconds)))
     
     return result_seconds
 
-async def get_last_post_time(bot_token, channel_id):
-    """Получает время последнего поста в канале"""
-    try:
-        bot = Bot(token=bot_token)
-        updates = await bot.get_updates(limit=100)
-        
-        channel_messages = [
-            update.channel_post for update in updates 
-            if update.channel_post and str(update.channel_post.chat.id) == str(channel_id)
-        ]
-        
-        if channel_messages:
-            last_message = max(channel_messages, key=lambda x: x.date)
-            logger.info(f"Last post time: {last_message.date}")
-            return last_message.date
-        
-        chat = await bot.get_chat(channel_id)
-        logger.info(f"Channel: {chat.title if hasattr(chat, 'title') else channel_id}")
-        
-        return None
-    except Exception as e:
-        logger.warning(f"Failed to get last post time: {e}")
-        return None
-
-async def send_to_telegram(image_url, caption, bot_token, channel_id, thread_id=None):
+async def send_to_telegram(bot, image_url, caption, channel_id, thread_id=None):
     """Отправляет изображение и ссылку в Telegram канал"""
-    bot = Bot(token=bot_token)
-    
     try:
+        # Telegram не может скачать с i.pximg.net без Referer — качаем сами и шлём байты
+        session = await get_http_session()
+        async with session.get(image_url) as response:
+            response.raise_for_status()
+            image_bytes = await response.read()
+
         send_params = {
             'chat_id': channel_id,
-            'photo': image_url,
+            'photo': image_bytes,
             'caption': caption,
             'parse_mode': 'HTML'
         }
         
         if thread_id:
             send_params['message_thread_id'] = thread_id
-            logger.info(f"Posting to thread: {thread_id}")
+            logger.info("Posting to thread: %s", thread_id)
         
-        message = await bot.send_photo(**send_params)
-        logger.info(f"Posted to Telegram channel: {channel_id}")
+        try:
+            message = await bot.send_photo(**send_params)
+        except RetryAfter as e:
+            logger.warning("Telegram rate limit, retrying in %ss", e.retry_after)
+            await asyncio.sleep(e.retry_after)
+            message = await bot.send_photo(**send_params)
+
+        logger.info("Posted to Telegram channel: %s", channel_id)
         return message.date
     except Exception as e:
-        logger.error(f"Failed to send to Telegram: {e}")
+        logger.error("Failed to send to Telegram: %s", e)
+        return None
+
+@pixiv_retry
+async def fetch_bookmark_page(api, **qs):
+    """Загружает одну страницу закладок, повторяя запрос при сетевых сбоях"""
+    async with PIXIV_RATE_LIMIT:
+        return await asyncio.wait_for(api.user_bookmarks_illust(**qs), timeout=PIXIV_PAGE_TIMEOUT)
+
+async def fetch_all_bookmarks(refresh_token):
+    """Собирает закладки пользователя из Pixiv и обновляет кэш на диске"""
+    api = await get_pixiv_client(refresh_token)
+
+    logger.info("Fetching bookmarks...")
+
+    json_result = await fetch_bookmark_page(api, user_id=api.user_id, restrict="public")
+
+    if not json_result or not json_result.get('illusts'):
+        logger.error("Failed to fetch bookmarks")
         return None
 
+    # Урезаем иллюстрации сразу при сборе: полный dict с тегами, сериями и
+    # meta_pages занимает килобайты, из которых нужны шесть полей
+    all_illusts = []
+    all_illusts.extend(slim_illust(illust) for illust in json_result.get('illusts', []))
+
+    # Эндпоинт пагинируется курсором max_bookmark_id из next_url, поэтому
+    # страницы нельзя перечислить заранее — идём по цепочке последовательно
+    pages_collected = 1
+    next_url = json_result.get('next_url')
+    page_qs = None
+
+    while next_url and pages_collected < MAX_PAGES_TO_FETCH:
+        # Полный разбор URL делаем один раз; дальше в next_url меняется
+        # только курсор, и его дешевле подставить в готовый словарь
+        cursor = MAX_BOOKMARK_ID_RE.search(next_url)
+        if page_qs is None or not cursor:
+            page_qs = api.parse_qs(next_url)
+        else:
+            page_qs['max_bookmark_id'] = cursor.group(1)
+
+        try:
+            json_result = await fetch_bookmark_page(api, **page_qs)
+        except Exception as e:
+            # Оставляем собранное, но показываем причину обрыва: системную
+            # ошибку нужно отличать от разового сетевого сбоя
+            logger.warning("Stopping pagination at page %d: %r", pages_collected + 1, e)
+            break
+
+        if not json_result:
+            break
+
+        illusts = json_result.get('illusts', [])
+        if not illusts:
+            break
+
+        all_illusts.extend(slim_illust(illust) for illust in illusts)
+        pages_collected += 1
+        next_url = json_result.get('next_url')
+
+    logger.info("Total collected: %d illustrations", len(all_illusts))
+
+    if not all_illusts:
+        return None
+
+    save_bookmark_cache(all_illusts)
+    return all_illusts
+
 async def get_random_pixiv_art_safe(refresh_token):
     """Безопасное получение случайной иллюстрации из закладок Pixiv"""
     try:
-        api = AppPixivAPI()
-        api.auth(refresh_token=refresh_token)
-        
-        logger.info(f"Authenticated as user: {api.user_id}")
-        logger.info("Fetching bookmarks...")
-        
-        json_result = api.user_bookmarks_illust(api.user_id, restrict="public")
-        
-        if not json_result or not json_result.get('illusts'):
-            logger.error("Failed to fetch bookmarks")
-            return None, None
-        
-        first_page_illusts = json_result.get('illusts', [])
-        total_estimate = len(first_page_illusts) * MAX_PAGES_TO_FETCH
-        
-        logger.info(f"Estimated bookmarks: ~{total_estimate} (max {MAX_PAGES_TO_FETCH} pages)")
-        
-        all_illusts = []
-        all_illusts.extend(first_page_illusts)
-        
-        pages_collected = 1
-        next_url = json_result.get('next_url')
-        
-        while next_url and pages_collected < MAX_PAGES_TO_FETCH:
-            await asyncio.sleep(PIXIV_REQUEST_DELAY)
-            
-            next_qs = api.parse_qs(next_url)
-            json_result = api.user_bookmarks_illust(**next_qs)
-            
-            if not json_result:
-                break
-                
-            illusts = json_result.get('illusts', [])
-            if not illusts:
-                break
-            
-            all_illusts.extend(illusts)
-            pages_collected += 1
-            
-            if pages_collected % 10 == 0:
-                logger.info(f"Progress: {pages_collected}/{MAX_PAGES_TO_FETCH} pages loaded")
-            
-            next_url = json_result.get('next_url')
-        
-        logger.info(f"Total collected: {len(all_illusts)} illustrations")
-        
-        if not all_illusts:
+        illusts = load_bookmark_cache()
+
+        if illusts is None:
+            logger.info("Bookmark cache is missing or stale, refreshing from Pixiv...")
+            illusts = await fetch_all_bookmarks(refresh_token)
+        else:
+            logger.info("Using bookmark cache: %d illustrations", len(illusts))
+
+        if not illusts:
             logger.error("No illustrations found")
             return None, None
-        
-        random_illust = random.choice(all_illusts)
-        
-        logger.info(f"Selected artwork:")
-        logger.info(f"  Title: {random_illust['title']}")
-        logger.info(f"  Author: {random_illust['user']['name']}")
-        logger.info(f"  ID: {random_illust['id']}")
-        logger.info(f"  Bookmarks: {random_illust['total_bookmarks']}, Views: {random_illust['total_view']}")
-        
-        import re
-        medium_url = random_illust['image_urls']['medium']
-        img_url = re.sub(r'/c/\d+x\d+_\d+/', '/', medium_url)
-        
-        author = random_illust['user']['name']
+
+        random_illust = _rng.choice(illusts)
+
+        logger.info("Selected artwork:")
+        logger.info("  Title: %s", random_illust['title'])
+        logger.info("  Author: %s", random_illust['author'])
+        logger.info("  ID: %s", random_illust['id'])
+        logger.info("  Bookmarks: %s, Views: %s", random_illust['total_bookmarks'], random_illust['total_view'])
+
+        img_url = PIXIV_THUMB_RE.sub('/', random_illust['image_url'])
+
+        author = random_illust['author']
         title = random_illust['title']
         artwork_url = f"https://www.pixiv.net/artworks/{random_illust['id']}"
-        
+
         caption = f"<b>{author}</b> | <a href=\"{artwork_url}\">{title}</a>"
-        
+
         return img_url, caption
-        
+
     except Exception as e:
-        logger.error(f"Failed to fetch artwork from Pixiv: {e}")
-        import traceback
+        logger.error("Failed to fetch artwork from Pixiv: %s", e)
         logger.error(traceback.format_exc())
         return None, None
 
-def is_quiet_hours(config):
-    """Проверяет, не тихие ли сейчас часы"""
-    quiet = config.get('quiet_hours', {})
-    
-    if not quiet.get('enabled', False):
-        return False
-    
-    now = datetime.now(MOSCOW_TZ)
-    current_hour = now.hour
-    start = quiet.get('start_hour', 0)
-    end = quiet.get('end_hour', 0)
-    
+def make_quiet_checker(config):
+    """Частично вычисляет проверку тихих часов: границы фиксируются один раз,
+    а возвращённому замыканию остаётся пара сравнений часа"""
+    if not config.quiet_enabled:
+        return lambda moment: False
+
+    start = config.quiet_start_hour
+    end = config.quiet_end_hour
+
     if start > end:
-        return current_hour >= start or current_hour < end
+        return lambda moment: moment.hour >= start or moment.hour < end
+    return lambda moment: start <= moment.hour < end
+
+def compute_next_post_time(config, now, is_quiet):
+    """Считает момент следующего поста, заранее перешагивая тихие часы"""
+    interval = calculate_next_interval(config.interval_seconds, config.deviation_minutes)
+    candidate = now + timedelta(seconds=interval)
+
+    if not is_quiet(candidate):
+        return candidate
+
+    # Попали в тихое окно — переносим публикацию на его конец,
+    # вместо того чтобы проспать интервал и молча пропустить пост
+    quiet_end = candidate.replace(hour=config.quiet_end_hour, minute=0, second=0, microsecond=0)
+    if quiet_end <= candidate:
+        quiet_end += timedelta(days=1)
+
+    logger.info("Quiet hours - next post moved to %s MSK", quiet_end.strftime('%H:%M:%S'))
+    return quiet_end
+
+async def post_random_art(bot, config, prefetch=None):
+    """Публикует случайную картинку (prefetch — заранее запущенная задача загрузки)"""
+    logger.info("\n".join([
+        "=" * 60,
+        f"Starting new post - {datetime.now(MOSCOW_TZ).strftime('%Y-%m-%d %H:%M:%S')} MSK",
+        "=" * 60,
+    ]))
+
+    if prefetch is not None:
+        img_url, caption = await prefetch
     else:
-        return start <= current_hour < end
+        img_url, caption = await get_random_pixiv_art_safe(config.pixiv_refresh_token)
 
-async def post_random_art(config):
-    """Публикует случайную картинку"""
-    logger.info("=" * 60)
-    logger.info(f"Starting new post - {datetime.now(MOSCOW_TZ).strftime('%Y-%m-%d %H:%M:%S')} MSK")
-    logger.info("=" * 60)
-    
-    img_url, caption = await get_random_pixiv_art_safe(config['pixiv_refresh_token'])
-    
     if img_url:
-        thread_id = config.get('telegram_thread_id')
-        
         post_time = await send_to_telegram(
-            img_url, 
-            caption, 
-            config['telegram_bot_token'], 
-            config['telegram_channel_id'],
-            thread_id
+            bot,
+            img_url,
+            caption,
+            config.telegram_channel_id,
+            config.telegram_thread_id
         )
         if post_time:
+            save_last_post_time(post_time)
             logger.info("Post completed successfully")
             return post_time
     else:
@@ -252,10 +491,9 @@ async def post_random_art(config):
 
 def format_time(seconds):
     """Форматирует секунды в читаемый вид"""
-    hours = int(seconds // 3600)
-    minutes = int((seconds % 3600) // 60)
-    secs = int(seconds % 60)
-    
+    hours, rem = divmod(int(seconds), 3600)
+    minutes, secs = divmod(rem, 60)
+
     parts = []
     if hours > 0:
         parts.append(f"{hours}h")
@@ -263,7 +501,7 @@ def format_time(seconds):
         parts.append(f"{minutes}m")
     if secs > 0 or not parts:
         parts.append(f"{secs}s")
-    
+
     return " ".join(parts)
 
 async def countdown_timer(total_seconds):
@@ -271,72 +509,112 @@ async def countdown_timer(total_seconds):
     start_time = datetime.now(MOSCOW_TZ)
     target_time = start_time + timedelta(seconds=total_seconds)
     
-    logger.info("=" * 60)
-    logger.info(f"Next post in: {format_time(total_seconds)}")
-    logger.info(f"Current time: {start_time.strftime('%H:%M:%S')} MSK")
-    logger.info(f"Target time:  {target_time.strftime('%H:%M:%S')} MSK")
-    logger.info("=" * 60)
-    
-    last_log = datetime.now(MOSCOW_TZ)
-    update_interval = 60
-    
-    while total_seconds > 0:
-        await asyncio.sleep(1)
-        total_seconds -= 1
-        now = datetime.now(MOSCOW_TZ)
-        
-        if (now - last_log).total_seconds() >= update_interval:
-            logger.info(f"Time remaining: {format_time(total_seconds)}")
-            last_log = now
-        
-        if 10 < total_seconds <= 60 and total_seconds % 10 == 0:
-            logger.info(f"Time remaining: {format_time(total_seconds)}")
-        
-        if total_seconds <= 10:
-            logger.info(f"Countdown: {total_seconds}s")
+    logger.info("\n".join([
+        "=" * 60,
+        f"Next post in: {format_time(total_seconds)}",
+        f"Current time: {start_time.strftime('%H:%M:%S')} MSK",
+        f"Target time:  {target_time.strftime('%H:%M:%S')} MSK",
+        "=" * 60,
+    ]))
     
+    total_seconds = int(total_seconds)
+
+    # Вместо пробуждения каждую секунду спим только до моментов логирования:
+    # каждую минуту, каждые 10 секунд на последней минуте, каждую секунду на последних 10
+    checkpoints = sorted(
+        set(range(60, total_seconds, 60)) |
+        set(range(10, min(60, total_seconds), 10)) |
+        set(range(1, min(10, total_seconds))),
+        reverse=True,
+    )
+
+    # Спим до абсолютного дедлайна: ошибка планировщика на каждом sleep
+    # не накапливается, и момент поста не уплывает за длинный интервал
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + total_seconds
+
+    for checkpoint in checkpoints:
+        delay = deadline - checkpoint - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        if checkpoint > 10:
+            logger.info("Time remaining: %s", format_time(checkpoint))
+        else:
+            logger.info("Countdown: %ds", checkpoint)
+
+    delay = deadline - loop.time()
+    if delay > 0:
+        await asyncio.sleep(delay)
     logger.info("Timer expired, starting post...")
 
 async def run_bot():
     """Основной цикл бота"""
     config = load_config()
     
-    logger.info("=" * 60)
-    logger.info("BOT STARTED")
-    logger.info(f"Post interval: {config['interval_hours']}h {config['interval_minutes']}m")
-    
-    deviation = config.get('interval_deviation_minutes', 0)
-    if deviation > 0:
-        logger.info(f"Interval deviation: ±{deviation} minutes")
+    lines = [
+        "=" * 60,
+        "BOT STARTED",
+        f"Post interval: {format_time(config.interval_seconds)}",
+    ]
+
+    if config.deviation_minutes > 0:
+        lines.append(f"Interval deviation: ±{config.deviation_minutes} minutes")
     else:
-        logger.info(f"Interval deviation: disabled")
-    
-    logger.info(f"Channel: {config['telegram_channel_id']}")
-    logger.info(f"Post on startup: {'enabled' if config['post_immediately_on_start'] else 'disabled'}")
-    
-    quiet = config.get('quiet_hours', {})
-    if quiet.get('enabled'):
-        logger.info(f"Quiet hours: {quiet['start_hour']}:00 - {quiet['end_hour']}:00")
-    
-    logger.info(f"Pixiv settings: max {MAX_PAGES_TO_FETCH} pages, {PIXIV_REQUEST_DELAY}s delay")
-    logger.info("=" * 60)
-    
-    base_interval_seconds = config['interval_hours'] * 3600 + config['interval_minutes'] * 60
-    deviation_minutes = config.get('interval_deviation_minutes', 0)
-    
-    if config['post_immediately_on_start'] and not is_quiet_hours(config):
-        await post_random_art(config)
-    
+        lines.append("Interval deviation: disabled")
+
+    lines.append(f"Channel: {config.telegram_channel_id}")
+    lines.append(f"Post on startup: {'enabled' if config.post_immediately_on_start else 'disabled'}")
+
+    if config.quiet_enabled:
+        lines.append(f"Quiet hours: {config.quiet_start_hour}:00 - {config.quiet_end_hour}:00")
+
+    lines.append(f"Pixiv settings: max {MAX_PAGES_TO_FETCH} pages, cache TTL {CACHE_TTL_SECONDS // 3600}h")
+
+    last_post = load_last_post_time()
+    if last_post:
+        lines.append(f"Last post: {last_post.strftime('%Y-%m-%d %H:%M:%S')}")
+
+    lines.append("=" * 60)
+    logger.info("\n".join(lines))
+
+    # Один Bot на всё время жизни процесса: initialize() поднимает пул
+    # соединений один раз, дальше работают keep-alive сессии
+    bot = get_bot(config.telegram_bot_token)
+    await bot.initialize()
+
+    is_quiet = make_quiet_checker(config)
+
+    try:
+        if config.post_immediately_on_start and not is_quiet(datetime.now(MOSCOW_TZ)):
+            await post_random_art(bot, config)
+
+        # TaskGroup отменяет и дожидается оставшиеся задачи (включая префетч)
+        # при любой ошибке вместо молчаливо умирающего фонового create_task
+        async with asyncio.TaskGroup() as tg:
+            tg.create_task(post_loop(bot, config, tg, is_quiet))
+    finally:
+        await bot.shutdown()
+
+async def prefetch_after(delay, refresh_token):
+    """Выдерживает паузу и запускает загрузку арта — фоновая часть префетча"""
+    await asyncio.sleep(delay)
+    return await get_random_pixiv_art_safe(refresh_token)
+
+async def post_loop(bot, config, tg, is_quiet):
+    """Бесконечный цикл публикаций: отсчёт, префетч и отправка"""
     while True:
-        next_interval = calculate_next_interval(base_interval_seconds, deviation_minutes)
-        
+        now = datetime.now(MOSCOW_TZ)
+        target = compute_next_post_time(config, now, is_quiet)
+        next_interval = (target - now).total_seconds()
+
+        # Загрузка арта стартует в фоне за PREFETCH_LEAD_SECONDS до публикации,
+        # а отсчёт при этом идёт до самого момента поста
+        lead = min(PREFETCH_LEAD_SECONDS, next_interval)
+        prefetch = tg.create_task(prefetch_after(next_interval - lead, config.pixiv_refresh_token))
+
         await countdown_timer(next_interval)
-        
-        if is_quiet_hours(config):
-            logger.info("QUIET HOURS - post skipped")
-            logger.info(f"Next attempt in: {format_time(next_interval)}")
-        else:
-            await post_random_art(config)
+        await post_random_art(bot, config, prefetch)
 
 async def main():
     """Точка входа"""
@@ -347,6 +625,9 @@ async def main():
     except Exception as e:
         logger.error(f"Critical error: {e}", exc_info=True)
         raise
+    finally:
+        if _http_session is not None and not _http_session.closed:
+            await _http_session.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file